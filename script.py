@@ -1,6 +1,14 @@
+import codecs
+import io
+import os
 import re
 import logging
-from typing import List, Dict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Dict, Optional, TextIO, Tuple, Union
 
 # Настройка логирования
 logging.basicConfig(
@@ -9,6 +17,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Размер блока чтения и буфера ввода-вывода
+CHUNK_SIZE = 1 << 20
+
+# Количество строк в одном INSERT по умолчанию
+DEFAULT_BATCH_SIZE = 1000
+
+# Примерный объем текста (в символах) в одном задании рабочего процесса
+PARALLEL_TASK_SIZE = 1 << 18
+# Сколько заданий на процесс может одновременно находиться в обработке
+PARALLEL_TASKS_PER_JOB = 4
+
 # Словарь соответствия типов данных
 TYPE_MAPPING = {
     'NVARCHAR': 'VARCHAR',
@@ -28,32 +47,198 @@ TYPE_MAPPING = {
     'TIMESTAMP': 'BYTEA'
 }
 
-def read_sql_file(file_path: str) -> str:
+# Виды значений в INSERT
+KIND_STRING = 'STRING'
+KIND_NUMBER = 'NUMBER'
+KIND_NULL = 'NULL'
+KIND_CAST = 'CAST'
+KIND_OTHER = 'OTHER'
+
+# Значение INSERT: (вид, текст в формате PostgreSQL)
+Value = Tuple[str, str]
+# Строка INSERT: (таблица, столбцы, значения)
+InsertRow = Tuple[str, Tuple[str, ...], List[Value]]
+# Элемент выходного потока: ключ (таблица, столбцы) для строк INSERT или None для готового текста
+OutputItem = Tuple[Optional[Tuple[str, Tuple[str, ...]]], Union[str, List[Value]]]
+
+# Предкомпилированные регулярные выражения
+# [dbo]. удаляется, [имя] заменяется на имя
+_RE_ID = re.compile(r'\[dbo\]\.|\[([^\]]+)\]')
+_RE_TYPE_SIZE = re.compile(r'(\w+)\s*\((\d+(?:,\s*\d+)?)\)')
+_RE_INSERT_LINE = re.compile(r'^\s*INSERT\s+', re.IGNORECASE)
+# Начало строки INSERT внутри многострочного блока - граница, по которой блок можно разрезать
+_RE_INSERT_START = re.compile(r'^[ \t]*INSERT\s', re.IGNORECASE | re.MULTILINE)
+_RE_TABLE_INSERT = re.compile(r'INSERT\s+(?:\[dbo\]\.)?(?:\[)?([^\]]+)(?:\])?\s*\(', re.IGNORECASE)
+_RE_COLUMNS = re.compile(r'\((.*?)\)\s*VALUES', re.IGNORECASE | re.DOTALL)
+_RE_VALUES = re.compile(r'VALUES\s*\((.*)\)', re.IGNORECASE | re.DOTALL)
+_RE_ALL_VALUES = re.compile(r'VALUES\s*\((.*?)\)', re.IGNORECASE | re.DOTALL)
+_RE_NUMBER = re.compile(r'^-?\d+(\.\d+)?$')
+_RE_STRING = re.compile(r"[Nn]?'(?:''|[^'])*'")
+# Экранирование спецсимволов в текстовом формате COPY
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+# CAST(значение AS тип[(размер)]); значение может содержать строки с " AS " внутри.
+# (?!') после закрывающей кавычки не дает разбить '' на две строки, иначе возможен экспоненциальный перебор
+_RE_CAST = re.compile(
+    r"CAST\(\s*((?:'(?:''|[^'])*'(?!')|[^'])+?)\s+AS\s+([A-Za-z_][A-Za-z0-9_]*(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?)\s*\)",
+    re.IGNORECASE
+)
+_RE_TABLE_CREATE = re.compile(r'CREATE\s+TABLE\s+(?:\[dbo\]\.)?(?:\[)?([^\]]+)(?:\])?', re.IGNORECASE)
+_RE_CONTENT_PRIMARY = re.compile(r'\((.*)\)\s*ON\s*\[PRIMARY\]', re.IGNORECASE | re.DOTALL)
+_RE_CONTENT = re.compile(r'\((.*?)\)(?:\s*GO)?$', re.IGNORECASE | re.DOTALL)
+_RE_IDENTITY = re.compile(r'IDENTITY\(\d+,\s*\d+\)', re.IGNORECASE)
+_RE_PK_CLUSTERED = re.compile(r'PRIMARY\s+KEY\s+CLUSTERED\s*\(\s*\[?([^\]]+)\]?\s*(?:ASC|DESC)?\s*\)', re.IGNORECASE)
+_RE_PK = re.compile(r'PRIMARY\s+KEY\s*\(\s*\[?([^\]]+)\]?\s*(?:ASC|DESC)?\s*\)', re.IGNORECASE)
+_RE_WITH = re.compile(r'WITH\s*\(', re.IGNORECASE)
+# Проверки без создания копии строки в верхнем регистре
+_RE_NULL = re.compile(r'NULL', re.IGNORECASE)
+_RE_IDENTITY_INSERT = re.compile(r'SET IDENTITY_INSERT', re.IGNORECASE)
+_RE_USE_PREFIX = re.compile(r'USE', re.IGNORECASE)
+_RE_CONSTRAINT = re.compile(r'CONSTRAINT', re.IGNORECASE)
+_RE_PRIMARY_KEY = re.compile(r'PRIMARY KEY', re.IGNORECASE)
+# Вид команды по первому ключевому слову (после комментариев, которые SSMS ставит перед объектами)
+_DISPATCH = re.compile(
+    r'\s*(?:(?:--[^\n]*|/\*.*?\*/)\s*)*(?P<kind>CREATE\s+TABLE|INSERT|USE|SET)\b',
+    re.IGNORECASE | re.DOTALL
+)
+# Строки в кавычках целиком, точка с запятой, разделитель пакетов GO или незакрытая кавычка
+_STMT_SPLIT = re.compile(r"""'(?:''|[^'])*'|"(?:""|[^"])*"|;|\bGO\b|['"]""", re.IGNORECASE)
+# Значение без скобок, двойных кавычек и комментариев: строки в одинарных кавычках и прочие символы кроме запятой
+_RE_SIMPLE_VALUE = re.compile(r"""(?:^|,)((?:'(?:''|[^'])*'|[^,'"()\-]+|-(?!-))*)""")
+# Структурные токены списков через запятую: строки в кавычках и комментарии (целиком), скобки и запятые.
+# Обычный текст между ними не сопоставляется, поэтому цикл на Python проходит только по этим токенам
+_VAL_TOKEN = re.compile(r"""'(?:''|[^'])*'?|"(?:""|[^"])*"?|--[^\n]*|[(),]""")
+
+# Все типы из TYPE_MAPPING одной альтернативой с необязательным размером.
+# Строки в кавычках сопоставляются целиком (без групп), чтобы не заменять слова внутри них
+_ALL_TYPES = re.compile(
+    r"'(?:''|[^'])*'|\b(" + '|'.join(map(re.escape, TYPE_MAPPING)) + r')\b(\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?',
+    re.IGNORECASE
+)
+# Имя столбца в начале определения
+_RE_COLUMN_NAME = re.compile(r'\s*(?:\[[^\]]*\]|\S+)')
+
+def _is_utf8(raw: io.BufferedReader) -> bool:
+    """Проверяет, что весь файл декодируется как UTF-8, и возвращает указатель в начало."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        for block in iter(partial(raw.read, CHUNK_SIZE), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return True
     except UnicodeDecodeError:
-        with open(file_path, 'r', encoding='cp1251') as f:
-            return f.read()
+        return False
+    finally:
+        raw.seek(0)
+
+def open_sql_file(file_path: str) -> io.TextIOWrapper:
+    """Открывает файл один раз, определяя кодировку: BOM, UTF-8, если декодируется весь файл, иначе CP1251."""
+    try:
+        raw = io.open(file_path, 'rb', buffering=CHUNK_SIZE)
     except Exception as e:
         logger.error(f"Error reading file: {e}")
         raise
 
+    if raw.peek(len(codecs.BOM_UTF8)).startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif _is_utf8(raw):
+        # Проверяется весь файл: в дампах CP1251 начало (USE, SET, CREATE TABLE) часто чисто ASCII
+        encoding = 'utf-8'
+    else:
+        encoding = 'cp1251'
+
+    logger.info(f"Detected encoding {encoding}")
+    return io.TextIOWrapper(raw, encoding=encoding)
+
+def read_sql_file(f: TextIO) -> Iterator[str]:
+    """Читает открытый файл блоками по CHUNK_SIZE символов."""
+    try:
+        yield from iter(partial(f.read, CHUNK_SIZE), '')
+    except Exception as e:
+        logger.error(f"Error reading file: {e}")
+        raise
+
+def iter_statements(f: TextIO) -> Iterator[str]:
+    """Потоково разбивает открытый файл на команды по ';' и GO, не учитывая разделители внутри строк."""
+    parts = []  # уже просмотренные куски текущей команды, склеиваются один раз при выдаче
+    buffer = ""
+    keep = 0  # начало непросмотренного хвоста буфера
+    string_char = None  # открывающая кавычка строки, не закрытой в предыдущем блоке
+
+    chunks = read_sql_file(f)
+    eof = False
+    while not eof:
+        chunk = next(chunks, None)
+        eof = chunk is None
+        # Новый буфер: один символ перед хвостом (для границы слова у GO), сам хвост и следующий блок
+        context = 1 if keep else 0
+        buffer = buffer[keep - context:] + (chunk or '')
+        start = pos = context
+
+        if string_char:
+            end = buffer.find(string_char, pos)
+            if end == -1:
+                pos = len(buffer)
+            else:
+                string_char = None
+                pos = end + 1
+
+        keep = None
+        if not string_char:
+            for m in _STMT_SPLIT.finditer(buffer, pos):
+                token = m.group(0)
+                if token in ("'", '"'):
+                    # Строка не закрыта: конец ищем в следующем блоке, а в конце файла она тянется до конца
+                    string_char = token
+                    pos = len(buffer)
+                    break
+                if token[0] in ("'", '"'):
+                    pos = m.end()
+                    continue
+                if token != ';' and m.end() == len(buffer) and not eof:
+                    # GO в конце буфера: ждем следующий блок, чтобы проверить границу слова
+                    keep = m.start()
+                    break
+
+                parts.append(buffer[start:m.end() if token == ';' else m.start()])
+                stmt = ''.join(parts).strip()
+                parts = []
+                if stmt:
+                    yield stmt
+                start = pos = m.end()
+
+        if keep is None:
+            # Оставляем последний символ: GO может оказаться на границе блоков
+            keep = pos if string_char else max(pos, len(buffer) - 1)
+        parts.append(buffer[start:keep])
+
+    stmt = (''.join(parts) + buffer[keep:]).strip()
+    if stmt:
+        yield stmt
+
 def clean_identifier(identifier: str) -> str:
     """Очищает идентификатор от квадратных скобок и dbo."""
-    identifier = re.sub(r'\[dbo\]\.', '', identifier)
-    identifier = re.sub(r'\[([^\]]+)\]', r'\1', identifier)
-    return identifier.strip().lower()  # PostgreSQL предпочитает нижний регистр
+    return _RE_ID.sub(lambda m: m.group(1) or '', identifier).strip().lower()  # PostgreSQL предпочитает нижний регистр
+
+@lru_cache(maxsize=4096)
+def _clean_name(name: str) -> str:
+    """Кэширующий clean_identifier для имен таблиц и столбцов (не для текста команд и определений)."""
+    return clean_identifier(name)
+
+@lru_cache(maxsize=4096)
+def _clean_columns(raw_columns: str) -> Tuple[str, ...]:
+    """Очищает список столбцов INSERT; одинаковый для всех строк таблицы, поэтому кэшируется целиком."""
+    return tuple(_clean_name(col) for col in raw_columns.split(','))
 
 def extract_type_size(data_type: str) -> tuple:
     """Извлекает тип данных и его размер (если есть)."""
-    size_match = re.search(r'(\w+)\s*\((\d+(?:,\s*\d+)?)\)', data_type)
+    size_match = _RE_TYPE_SIZE.search(data_type)
     if size_match:
         base_type = size_match.group(1).upper()
         size = size_match.group(2)
         return base_type, size
     return data_type.upper(), None
 
+@lru_cache(maxsize=2048)
 def convert_type_with_size(mssql_type: str) -> str:
     """Конвертирует тип данных с сохранением размера."""
     base_type, size = extract_type_size(mssql_type)
@@ -69,218 +254,225 @@ def convert_type_with_size(mssql_type: str) -> str:
     else:
         return mssql_type.lower()
 
-def convert_insert(statement: str) -> str:
-    """Конвертирует INSERT-запрос из MSSQL в PostgreSQL формат."""
-    if 'SET IDENTITY_INSERT' in statement.upper():
-        return ''
+def _classify_value(value: str) -> Value:
+    """Определяет вид значения и переводит его в формат PostgreSQL."""
+    # Обработка NULL
+    if _RE_NULL.fullmatch(value):
+        return KIND_NULL, 'NULL'
+    # Обработка чисел
+    if _RE_NUMBER.match(value):
+        return KIND_NUMBER, value
+    # Обработка строк, в том числе с N префиксом
+    if _RE_STRING.fullmatch(value):
+        return KIND_STRING, value[1:] if value[0] in 'Nn' else value
+    # Обработка CAST выражений
+    cast_match = _RE_CAST.fullmatch(value)
+    if cast_match:
+        # Конвертируем тип данных если нужно (результат кэшируется по исходному типу)
+        pg_type = convert_type_with_size(cast_match.group(2))
+        return KIND_CAST, f"{cast_match.group(1)}::{pg_type}"
+    # Остальные значения оставляем как есть
+    return KIND_OTHER, value
+
+def _split_top_level_commas(s: str) -> List[str]:
+    """Разбивает строку по запятым вне скобок, строк в кавычках и комментариев."""
+    items = []
+    start = 0
+    bracket_count = 0
+
+    for m in _VAL_TOKEN.finditer(s):
+        token = m.group(0)
+        if token == '(':
+            bracket_count += 1
+        elif token == ')':
+            bracket_count -= 1
+        elif token == ',' and bracket_count == 0:
+            items.append(s[start:m.start()].strip())
+            start = m.end()
+
+    if start < len(s):
+        items.append(s[start:].strip())
+
+    return items
+
+def _split_values(values_str: str) -> List[Value]:
+    """Разбивает список значений по запятым верхнего уровня и сразу классифицирует каждое значение."""
+    # Быстрый путь: без вложенных скобок (и CAST) достаточно одного findall.
+    # Если findall пропустил хоть один символ (скобку, кавычку, комментарий), идем общим путем
+    items = _RE_SIMPLE_VALUE.findall(values_str)
+    if len(items) - 1 + sum(map(len, items)) == len(values_str):
+        # Как и в общем случае, пустой хвост после последней запятой не считается значением
+        if values_str[-1:] in ('', ','):
+            items.pop()
+        return [_classify_value(item.strip()) for item in items]
+
+    return [_classify_value(item) for item in _split_top_level_commas(values_str)]
+
+def parse_insert(statement: str) -> Optional[List[InsertRow]]:
+    """Разбирает INSERT-запросы MSSQL на строки (таблица, столбцы, значения в формате PostgreSQL).
+
+    Возвращает None, если в команде не найдено ни одного INSERT.
+    """
+    if _RE_IDENTITY_INSERT.search(statement):
+        return []
 
     # Разделяем множественные INSERT-запросы
     # Улучшенный поиск INSERT-запросов с учетом сложной структуры
     insert_statements = []
-    current_stmt = ""
-    in_insert = False
+    current_lines = []
 
     for line in statement.split('\n'):
-        if re.search(r'^\s*INSERT\s+', line, re.IGNORECASE):
-            if in_insert and current_stmt:
-                insert_statements.append(current_stmt)
-            current_stmt = line
-            in_insert = True
-        elif in_insert:
-            current_stmt += "\n" + line
+        if _RE_INSERT_LINE.search(line):
+            if current_lines:
+                insert_statements.append('\n'.join(current_lines))
+            current_lines = [line]
+        elif current_lines:
+            current_lines.append(line)
 
-    if in_insert and current_stmt:
-        insert_statements.append(current_stmt)
+    if current_lines:
+        insert_statements.append('\n'.join(current_lines))
 
     if not insert_statements:
         logger.warning(f"Could not parse INSERT statements: {statement[:100]}...")
-        return statement
+        return None
 
-    converted_statements = []
+    rows = []
 
     for insert_stmt in insert_statements:
         # Извлекаем имя таблицы
-        table_match = re.search(r'INSERT\s+(?:\[dbo\]\.)?(?:\[)?([^\]]+)(?:\])?\s*\(', insert_stmt, re.IGNORECASE)
+        table_match = _RE_TABLE_INSERT.search(insert_stmt)
         if not table_match:
             logger.warning(f"Could not parse table name in INSERT statement: {insert_stmt[:100]}...")
             continue
 
-        table_name = clean_identifier(table_match.group(1))
+        table_name = _clean_name(table_match.group(1))
 
         # Извлекаем столбцы
-        columns_match = re.search(r'\((.*?)\)\s*VALUES', insert_stmt, re.IGNORECASE | re.DOTALL)
+        columns_match = _RE_COLUMNS.search(insert_stmt)
         if not columns_match:
             logger.warning(f"Could not parse columns in INSERT statement: {insert_stmt[:100]}...")
             continue
 
         # Очищаем имена столбцов
-        columns = [clean_identifier(col) for col in columns_match.group(1).split(',')]
+        columns = _clean_columns(columns_match.group(1))
 
         # Извлекаем значения
         # Более надежный поиск значений с учетом переносов строк
-        values_match = re.search(r'VALUES\s*\((.*)\)', insert_stmt, re.IGNORECASE | re.DOTALL)
+        values_match = _RE_VALUES.search(insert_stmt)
         if not values_match:
             logger.warning(f"Could not parse VALUES in INSERT statement: {insert_stmt[:100]}...")
             continue
 
         # Обработка значений с учетом вложенных скобок
-        values_str = values_match.group(1)
-        values = []
-        current_value = ""
-        bracket_count = 0
-        in_string = False
-        string_char = None
-
-        for char in values_str:
-            if char in ["'", '"'] and (not string_char or char == string_char):
-                if not in_string:
-                    in_string = True
-                    string_char = char
-                else:
-                    in_string = False
-                    string_char = None
-                current_value += char
-            elif char == '(' and not in_string:
-                bracket_count += 1
-                current_value += char
-            elif char == ')' and not in_string:
-                bracket_count -= 1
-                current_value += char
-            elif char == ',' and bracket_count == 0 and not in_string:
-                values.append(current_value.strip())
-                current_value = ""
-            else:
-                current_value += char
-
-        if current_value:
-            values.append(current_value.strip())
+        values = _split_values(values_match.group(1))
 
         # Если количество значений не соответствует количеству столбцов, пытаемся исправить
         if len(values) != len(columns):
             # Проверяем, есть ли в строке VALUES несколько наборов значений
-            all_values_match = re.findall(r'VALUES\s*\((.*?)\)', insert_stmt, re.IGNORECASE | re.DOTALL)
+            all_values_match = _RE_ALL_VALUES.findall(insert_stmt)
             if len(all_values_match) > 1:
                 # Обрабатываем множественные VALUES
-                processed_statements = []
+                processed_rows = []
                 for value_set in all_values_match:
-                    # Разбиваем значения и обрабатываем их
-                    value_items = []
-                    current_item = ""
-                    bracket_count = 0
-                    in_string = False
-                    string_char = None
-
-                    for char in value_set:
-                        if char in ["'", '"'] and (not string_char or char == string_char):
-                            if not in_string:
-                                in_string = True
-                                string_char = char
-                            else:
-                                in_string = False
-                                string_char = None
-                            current_item += char
-                        elif char == '(' and not in_string:
-                            bracket_count += 1
-                            current_item += char
-                        elif char == ')' and not in_string:
-                            bracket_count -= 1
-                            current_item += char
-                        elif char == ',' and bracket_count == 0 and not in_string:
-                            value_items.append(current_item.strip())
-                            current_item = ""
-                        else:
-                            current_item += char
-
-                    if current_item:
-                        value_items.append(current_item.strip())
-
-                    # Обрабатываем значения и создаем INSERT
-                    processed_values = []
-                    for value in value_items:
-                        if value.upper() == 'NULL':
-                            processed_values.append('NULL')
-                        elif re.match(r'^-?\d+(\.\d+)?$', value):
-                            processed_values.append(value)
-                        elif value.startswith("N'"):
-                            processed_values.append(value[1:])
-                        elif 'CAST' in value.upper():
-                            cast_match = re.search(r"CAST\(([^AS]+)AS\s+([^\)]+)\)", value, re.IGNORECASE)
-                            if cast_match:
-                                cast_value = cast_match.group(1).strip()
-                                cast_type = cast_match.group(2).strip()
-                                pg_type = TYPE_MAPPING.get(cast_type.upper(), cast_type.lower())
-                                processed_values.append(f"{cast_value}::{pg_type}")
-                        else:
-                            processed_values.append(value)
-
-                    if len(processed_values) == len(columns):
-                        columns_str = ', '.join(columns)
-                        values_str = ', '.join(processed_values)
-                        processed_statements.append(f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});")
-
-                if processed_statements:
-                    converted_statements.extend(processed_statements)
+                    value_items = _split_values(value_set)
+                    if len(value_items) == len(columns):
+                        processed_rows.append((table_name, columns, value_items))
+
+                if processed_rows:
+                    rows.extend(processed_rows)
                     continue
 
             logger.warning(f"Column count ({len(columns)}) does not match values count ({len(values)}) in: {insert_stmt[:100]}...")
             # Попытка восстановить значения, если их не хватает
             if len(values) < len(columns):
-                values.extend(['NULL'] * (len(columns) - len(values)))
+                values.extend([(KIND_NULL, 'NULL')] * (len(columns) - len(values)))
             elif len(values) > len(columns):
                 values = values[:len(columns)]
 
-        processed_values = []
-        for value in values:
-            value = value.strip()
-            # Обработка NULL
-            if value.upper() == 'NULL':
-                processed_values.append('NULL')
-            # Обработка чисел
-            elif re.match(r'^-?\d+(\.\d+)?$', value):
-                processed_values.append(value)
-            # Обработка строк с N префиксом
-            elif value.startswith("N'"):
-                processed_values.append(value[1:])
-            # Обработка CAST выражений
-            elif 'CAST' in value.upper():
-                cast_match = re.search(r"CAST\(([^AS]+)AS\s+([^\)]+)\)", value, re.IGNORECASE)
-                if cast_match:
-                    cast_value = cast_match.group(1).strip()
-                    cast_type = cast_match.group(2).strip()
-                    # Конвертируем тип данных если нужно
-                    pg_type = TYPE_MAPPING.get(cast_type.upper(), cast_type.lower())
-                    processed_values.append(f"{cast_value}::{pg_type}")
-            # Остальные значения оставляем как есть
-            else:
-                processed_values.append(value)
+        rows.append((table_name, columns, values))
+
+    return rows
+
+
+def format_insert(table_name: str, columns: Tuple[str, ...], rows: List[List[Value]]) -> str:
+    """Собирает INSERT с одним или несколькими наборами значений."""
+    columns_str = ', '.join(columns)
+    values_str = ',\n'.join(f"({', '.join(text for _, text in values)})" for values in rows)
+    if len(rows) == 1:
+        return f"INSERT INTO {table_name} ({columns_str}) VALUES {values_str};"
+    return f"INSERT INTO {table_name} ({columns_str}) VALUES\n{values_str};"
+
+
+def _copy_value(kind: str, text: str) -> Optional[str]:
+    """Переводит значение INSERT в поле текстового формата COPY; None, если это не литерал."""
+    if kind == KIND_CAST:
+        # Приведение выполнит сам PostgreSQL по типу столбца, оставляем исходное значение
+        kind, text = _classify_value(text.rpartition('::')[0])
+    if kind == KIND_NULL:
+        return '\\N'
+    if kind == KIND_STRING:
+        return text[1:-1].replace("''", "'").translate(_COPY_ESCAPES)
+    if kind == KIND_NUMBER:
+        return text
+    # Выражения (0x..., функции, конкатенация) COPY передал бы как текст, а не вычислил
+    return None
+
+
+def format_copy(table_name: str, columns: Tuple[str, ...], rows: List[List[Value]]) -> str:
+    """Собирает блок COPY ... FROM STDIN с данными в текстовом формате PostgreSQL.
+
+    COPY переносит только литералы; строки, в которых есть выражения, выводятся как INSERT.
+    """
+    columns_str = ', '.join(columns)
+    fields = [[_copy_value(kind, text) for kind, text in values] for values in rows]
+    blocks = []
+    for is_literal, group in groupby(zip(rows, fields), key=lambda row: None not in row[1]):
+        group = list(group)
+        if is_literal:
+            data = '\n'.join('\t'.join(row_fields) for _, row_fields in group)
+            blocks.append(f"COPY {table_name} ({columns_str}) FROM STDIN;\n{data}\n\\.")
+        else:
+            logger.warning(f"{len(group)} row(s) for {table_name} contain SQL expressions, writing them as INSERT")
+            blocks.append(format_insert(table_name, columns, [values for values, _ in group]))
+    return '\n\n'.join(blocks)
+
+
+# Форматы вывода строк INSERT
+OUTPUT_FORMATS = {
+    'insert': format_insert,
+    'copy': format_copy,
+}
 
-        # Собираем новый INSERT-запрос
-        columns_str = ', '.join(columns)
-        values_str = ', '.join(processed_values)
-        insert_statement = f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});"
-        converted_statements.append(insert_statement)
 
-    return '\n'.join(converted_statements)
+def _type_sub(m: re.Match) -> str:
+    """Заменяет тип MSSQL, найденный _ALL_TYPES, на тип PostgreSQL; строки в кавычках не меняет."""
+    if m.group(1) is None:
+        return m.group(0)
+    pg_type = TYPE_MAPPING[m.group(1).upper()]
+    # Если у нового типа уже есть скобки (например DECIMAL(19,4)), не добавляем размер
+    if '(' in pg_type or m.group(2) is None:
+        return pg_type
+    return pg_type + m.group(2).strip()
 
 def convert_create_table(statement: str) -> str:
     """Конвертирует CREATE TABLE из MSSQL в PostgreSQL."""
     # Убираем USE statement и другие MS SQL специфичные команды
-    if statement.upper().startswith('USE'):
+    if _RE_USE_PREFIX.match(statement):
         return ''
 
     # Извлекаем имя таблицы
-    table_match = re.search(r'CREATE\s+TABLE\s+(?:\[dbo\]\.)?(?:\[)?([^\]]+)(?:\])?', statement, re.IGNORECASE)
+    table_match = _RE_TABLE_CREATE.search(statement)
     if not table_match:
         logger.warning(f"Could not parse table name in CREATE TABLE statement: {statement[:100]}...")
         return statement
 
-    table_name = clean_identifier(table_match.group(1))
+    table_name = _clean_name(table_match.group(1))
 
     # Ищем основное содержимое таблицы
-    main_content = re.search(r'\((.*)\)\s*ON\s*\[PRIMARY\]', statement, re.IGNORECASE | re.DOTALL)
+    main_content = _RE_CONTENT_PRIMARY.search(statement)
     if not main_content:
         # Пробуем найти содержимое без ON [PRIMARY]
-        main_content = re.search(r'\((.*?)\)(?:\s*GO)?$', statement, re.IGNORECASE | re.DOTALL)
+        main_content = _RE_CONTENT.search(statement)
         if not main_content:
             logger.warning(f"Could not parse table content in CREATE TABLE statement: {statement[:100]}...")
             return statement
@@ -293,58 +485,33 @@ def convert_create_table(statement: str) -> str:
     # Флаги для отслеживания ограничений
     primary_key_columns = []
 
-    # Разбиваем контент на строки, сохраняя структуру PRIMARY KEY
-    current_definition = ""
-    bracket_count = 0
+    # Разбиваем контент на определения, сохраняя структуру PRIMARY KEY
+    for definition in _split_top_level_commas(content):
+        if not definition:
+            continue
+        # Проверяем, является ли это PRIMARY KEY CLUSTERED
+        pk_match = _RE_PK_CLUSTERED.search(definition)
+        if pk_match:
+            primary_key_columns.append(_clean_name(pk_match.group(1)))
+        # Проверяем, является ли это CONSTRAINT PRIMARY KEY
+        elif _RE_CONSTRAINT.search(definition) and _RE_PRIMARY_KEY.search(definition):
+            pk_match = _RE_PK.search(definition)
+            if pk_match:
+                primary_key_columns.append(_clean_name(pk_match.group(1)))
+        # Обычное определение колонки
+        elif not _RE_WITH.search(definition):
+            # Конвертируем типы данных (имя столбца не трогаем)
+            name_end = _RE_COLUMN_NAME.match(definition).end()
+            definition = definition[:name_end] + _ALL_TYPES.sub(_type_sub, definition[name_end:])
+
+            # Заменяем IDENTITY на SERIAL
+            definition = _RE_IDENTITY.sub('SERIAL', definition)
+
+            # Очищаем от квадратных скобок
+            definition = clean_identifier(definition)
 
-    for char in content:
-        current_definition += char
-        if char == '(':
-            bracket_count += 1
-        elif char == ')':
-            bracket_count -= 1
-        elif char == ',' and bracket_count == 0:
-            # Обрабатываем текущее определение
-            definition = current_definition.strip().rstrip(',')
             if definition:
-                # Проверяем, является ли это PRIMARY KEY CLUSTERED
-                pk_match = re.search(r'PRIMARY\s+KEY\s+CLUSTERED\s*\(\s*\[?([^\]]+)\]?\s*(?:ASC|DESC)?\s*\)',
-                                   definition, re.IGNORECASE)
-                if pk_match:
-                    primary_key_columns.append(clean_identifier(pk_match.group(1)))
-                # Проверяем, является ли это CONSTRAINT PRIMARY KEY
-                elif 'CONSTRAINT' in definition.upper() and 'PRIMARY KEY' in definition.upper():
-                    pk_match = re.search(r'PRIMARY\s+KEY\s*\(\s*\[?([^\]]+)\]?\s*(?:ASC|DESC)?\s*\)',
-                                       definition, re.IGNORECASE)
-                    if pk_match:
-                        primary_key_columns.append(clean_identifier(pk_match.group(1)))
-                # Обычное определение колонки
-                elif not re.search(r'WITH\s*\(', definition, re.IGNORECASE):
-                    # Конвертируем типы данных
-                    for mssql_type in TYPE_MAPPING.keys():
-                        pattern = r'\b' + re.escape(mssql_type) + r'(?:\s*\(\s*(\d+)(?:\s*,\s*\d+)?\s*\))?'
-                        type_match = re.search(pattern, definition, re.IGNORECASE)
-                        if type_match:
-                            old_type = type_match.group(0)
-                            new_type = convert_type_with_size(old_type)
-                            definition = definition.replace(old_type, new_type)
-                            break
-
-                    # Заменяем IDENTITY на SERIAL
-                    definition = re.sub(r'IDENTITY\(\d+,\s*\d+\)', 'SERIAL', definition, flags=re.IGNORECASE)
-
-                    # Очищаем от квадратных скобок
-                    definition = clean_identifier(definition)
-
-                    if definition:
-                        parts.append(definition)
-            current_definition = ""
-
-    # Обрабатываем последнее определение
-    if current_definition.strip():
-        definition = current_definition.strip()
-        if not re.search(r'WITH\s*\(', definition, re.IGNORECASE):
-            parts.append(clean_identifier(definition))
+                parts.append(definition)
 
     # Добавляем PRIMARY KEY в конец, если нашли
     if primary_key_columns:
@@ -358,71 +525,141 @@ def convert_create_table(statement: str) -> str:
     return create_statement
 
 
-def convert_mssql_to_postgresql(input_file: str, output_file: str):
+def convert_statement(stmt: str) -> List[OutputItem]:
+    """Конвертирует одну команду в элементы выходного потока.
+
+    Строки INSERT возвращаются с ключом (таблица, столбцы), чтобы их можно было
+    объединить в пакеты; прочие команды - готовым текстом с ключом None.
+    """
+    m = _DISPATCH.match(stmt)
+    kind = m.group('kind').upper().split()[0] if m else None
+    if kind == 'CREATE':
+        converted = convert_create_table(stmt)
+    elif kind == 'INSERT':
+        rows = parse_insert(stmt)
+        if rows is not None:
+            return [((table_name, columns), values) for table_name, columns, values in rows]
+        converted = stmt
+    elif kind is None:
+        # Убираем точку с запятой, если она есть, и добавляем снова
+        if stmt.endswith(';'):
+            stmt = stmt[:-1]
+        converted = clean_identifier(stmt) + ";"
+    else:
+        converted = ''
+    return [(None, converted)] if converted else []
+
+
+def _split_work(stmt: str) -> Iterator[str]:
+    """Режет большой блок INSERT на части примерно по PARALLEL_TASK_SIZE символов по границам строк INSERT.
+
+    parse_insert и так разбирает блок построчно, поэтому результат по частям совпадает с результатом целиком.
+    """
+    if len(stmt) <= PARALLEL_TASK_SIZE:
+        yield stmt
+        return
+    m = _DISPATCH.match(stmt)
+    # SET IDENTITY_INSERT внутри блока отбрасывает весь блок - такой блок не режем
+    if not m or m.group('kind').upper() != 'INSERT' or _RE_IDENTITY_INSERT.search(stmt):
+        yield stmt
+        return
+
+    start = 0
+    while True:
+        m = _RE_INSERT_START.search(stmt, start + PARALLEL_TASK_SIZE)
+        if not m:
+            yield stmt[start:]
+            return
+        yield stmt[start:m.start()]
+        start = m.start()
+
+
+def _convert_task(statements: List[str]) -> List[List[OutputItem]]:
+    """Задание рабочего процесса: конвертирует группу команд."""
+    return [convert_statement(stmt) for stmt in statements]
+
+
+def _iter_tasks(units: Iterable[str]) -> Iterator[Tuple[List[str], int]]:
+    """Группирует команды в задания примерно по PARALLEL_TASK_SIZE символов."""
+    task = []
+    size = 0
+    for unit in units:
+        task.append(unit)
+        size += len(unit)
+        if size >= PARALLEL_TASK_SIZE:
+            yield task, size
+            task = []
+            size = 0
+    if task:
+        yield task, size
+
+
+def _convert_statements(statements: Iterable[str], jobs: int = 1) -> Iterator[List[OutputItem]]:
+    """Применяет convert_statement к командам в jobs процессах, сохраняя порядок.
+
+    Крупные блоки INSERT конвертируются по частям: так они делятся между процессами,
+    а строки всего блока не собираются в памяти одновременно.
+    """
+    units = chain.from_iterable(map(_split_work, statements))
+    if jobs <= 1:
+        yield from map(convert_statement, units)
+        return
+
+    # Объем текста в обработке ограничен, чтобы не держать в памяти весь файл:
+    # когда лимит превышен, ждем самое старое задание и отдаем его результаты
+    max_in_flight = jobs * PARALLEL_TASKS_PER_JOB * PARALLEL_TASK_SIZE
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        in_flight = 0
+        for task, size in _iter_tasks(units):
+            pending.append((executor.submit(_convert_task, task), size))
+            in_flight += size
+            while in_flight > max_in_flight:
+                future, size = pending.popleft()
+                in_flight -= size
+                yield from future.result()
+        while pending:
+            future, _ = pending.popleft()
+            yield from future.result()
+
+
+def iter_output(statements: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE, jobs: int = 1,
+                output_format: str = 'insert') -> Iterator[str]:
+    """Конвертирует команды, объединяя подряд идущие строки одной таблицы в INSERT или COPY до batch_size строк."""
+    format_rows = OUTPUT_FORMATS[output_format]
+    items = chain.from_iterable(_convert_statements(statements, jobs))
+    for key, group in groupby(items, key=itemgetter(0)):
+        if key is None:
+            for _, converted in group:
+                yield converted
+            continue
+
+        table_name, columns = key
+        rows = (values for _, values in group)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            yield format_rows(table_name, columns, batch)
+
+
+def _iter_out(statements: Iterable[str]) -> Iterator[str]:
+    """Добавляет пустую строку после каждой команды."""
+    for stmt in statements:
+        yield stmt
+        yield "\n\n"
+
+
+def convert_mssql_to_postgresql(input_file: str, output_file: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                                jobs: int = 1, output_format: str = 'insert'):
     try:
+        # Входной файл открывается первым, чтобы при ошибке не затирать существующий выходной
         logger.info(f"Reading file {input_file}")
-        content = read_sql_file(input_file)
-
-        # Разделяем файл на блоки по GO
-        blocks = re.split(r'\bGO\b', content, flags=re.IGNORECASE)
-
-        converted_statements = []
-        for block in blocks:
-            if not block.strip():
-                continue
-
-            # Разделяем блок на отдельные команды по точке с запятой
-            # Учитываем, что точка с запятой может быть в строках в кавычках
-            statements = []
-            current_stmt = ""
-            in_string = False
-            string_char = None
-
-            for char in block:
-                if char in ["'", '"'] and (not string_char or char == string_char):
-                    if not in_string:
-                        in_string = True
-                        string_char = char
-                    else:
-                        in_string = False
-                        string_char = None
-                    current_stmt += char
-                elif char == ';' and not in_string:
-                    current_stmt += char
-                    if current_stmt.strip():
-                        statements.append(current_stmt.strip())
-                    current_stmt = ""
-                else:
-                    current_stmt += char
-
-            if current_stmt.strip():
-                statements.append(current_stmt.strip())
-
-            for stmt in statements:
-                stmt = stmt.strip()
-                if not stmt:
-                    continue
-
-                stmt_upper = stmt.upper()
-                if 'CREATE TABLE' in stmt_upper:
-                    converted = convert_create_table(stmt)
-                    if converted:
-                        converted_statements.append(converted)
-                elif 'INSERT' in stmt_upper:
-                    converted = convert_insert(stmt)
-                    if converted:
-                        converted_statements.append(converted)
-                elif not any(cmd in stmt_upper for cmd in ['USE', 'SET']):
-                    # Убираем точку с запятой, если она есть, и добавляем снова
-                    if stmt.endswith(';'):
-                        stmt = stmt[:-1]
-                    converted = clean_identifier(stmt) + ";"
-                    converted_statements.append(converted)
-
-        logger.info(f"Writing output to {output_file}")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for stmt in converted_statements:
-                f.write(f"{stmt}\n\n")
+        with open_sql_file(input_file) as source:
+            logger.info(f"Writing output to {output_file}")
+            with open(output_file, 'w', encoding='utf-8', buffering=CHUNK_SIZE, newline='\n') as f:
+                statements = iter_statements(source)
+                f.writelines(_iter_out(iter_output(statements, batch_size, jobs, output_format)))
 
         logger.info("Conversion completed successfully")
 
@@ -431,17 +668,28 @@ def convert_mssql_to_postgresql(input_file: str, output_file: str):
         raise
 
 if __name__ == "__main__":
+    import argparse
     import sys
 
-    if len(sys.argv) != 3:
-        print("Usage: python script.py input_file.sql output_file.sql")
-        sys.exit(1)
-
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Convert MSSQL script to PostgreSQL")
+    parser.add_argument('input_file', help="MSSQL script to convert")
+    parser.add_argument('output_file', help="where to write the PostgreSQL script")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"max rows per INSERT or COPY block (default {DEFAULT_BATCH_SIZE}, 1 disables batching)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS), default='insert',
+                        help="emit rows as INSERT statements (default) or COPY FROM STDIN blocks")
+    args = parser.parse_args()
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
 
     try:
-        convert_mssql_to_postgresql(input_file, output_file)
+        convert_mssql_to_postgresql(args.input_file, args.output_file, args.batch_size, args.jobs,
+                                    args.output_format)
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)